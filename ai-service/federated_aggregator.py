@@ -9,33 +9,48 @@ Implements:
 
 from __future__ import annotations
 
+import base64
 import hashlib
 import json
 import math
 import os
-import random
 from dataclasses import dataclass
 from typing import Dict, List, Sequence
 
+import numpy as np
+
+# Optional faster JSON parser; falls back to the stdlib when unavailable.
+try:
+    import orjson  # type: ignore
+except Exception:  # pragma: no cover
+    orjson = None
+
+HASH_CHUNK_BYTES = 1 << 20
+MODEL_HASH_VERSION = b"PGv1|"
+# Wire encodings accepted for base64 weight payloads.
+WEIGHT_DTYPES = ("float32", "float16", "bfloat16")
+
 
 @dataclass
 class ClientUpdate:
     client_id: str
     num_examples: int
-    weights: List[float]
+    weights: Sequence[float] | np.ndarray
 
 
 @dataclass
-class AggregationConfig:
-    clipping_norm: float = 2.0
-    noise_stddev: float = 0.0
+class ClientBatch:
+    """All client updates of a round as one contiguous (K, D) matrix.
 
+    The matrix is float16 when every client sent half precision, float32 otherwise.
+    """
 
-class SecureFederatedAggregator:
-    def __init__(self, config: AggregationConfig | None = None):
-        self.config = config or AggregationConfig()
+    client_ids: List[str]
+    counts: np.ndarray
+    weights: np.ndarray
 
-    def aggregate(self, updates: Sequence[ClientUpdate]) -> List[float]:
+    @classmethod
+    def from_updates(cls, updates: Sequence[ClientUpdate]) -> "ClientBatch":
         if not updates:
             raise ValueError("No client updates supplied")
 
@@ -43,83 +58,213 @@ class SecureFederatedAggregator:
         if dim == 0:
             raise ValueError("Empty model update vector")
 
-        clipped: List[ClientUpdate] = []
-        for update in updates:
+        # Keep half precision only when every row really is a float16 array.
+        half = all(isinstance(u.weights, np.ndarray) and u.weights.dtype == np.float16 for u in updates)
+        storage = np.float16 if half else np.float32
+        weights = np.empty((len(updates), dim), dtype=storage)
+        for row, update in enumerate(updates):
             if len(update.weights) != dim:
                 raise ValueError("All updates must have same dimension")
-            clipped.append(
-                ClientUpdate(
-                    client_id=update.client_id,
-                    num_examples=update.num_examples,
-                    weights=self._clip(update.weights),
-                )
-            )
-
-        total_examples = sum(max(1, u.num_examples) for u in clipped)
-
-        agg = [0.0 for _ in range(dim)]
-        for update in clipped:
-            weight = max(1, update.num_examples) / total_examples
-            for i in range(dim):
-                agg[i] += update.weights[i] * weight
+            weights[row] = update.weights
+            _require_finite(weights[row], update.client_id)
+
+        return cls(
+            client_ids=[update.client_id for update in updates],
+            counts=np.fromiter((u.num_examples for u in updates), dtype=np.int64, count=len(updates)),
+            weights=weights,
+        )
+
+
+@dataclass
+class AggregationConfig:
+    clipping_norm: float = 2.0
+    noise_stddev: float = 0.0
+
+
+class SecureFederatedAggregator:
+    def __init__(self, config: AggregationConfig | None = None):
+        self.config = config or AggregationConfig()
+        self._rng = np.random.default_rng()
+
+    def aggregate(self, updates: ClientBatch | Sequence[ClientUpdate]) -> List[float]:
+        batch = updates if isinstance(updates, ClientBatch) else ClientBatch.from_updates(updates)
+        # Single upcast pass for half-precision transport; BLAS still runs at FP32.
+        matrix = batch.weights.astype(np.float32, copy=False)
+        if matrix.shape[0] == 0:
+            raise ValueError("No client updates supplied")
+        if matrix.shape[1] == 0:
+            raise ValueError("Empty model update vector")
+
+        counts = np.maximum(batch.counts, 1).astype(np.float64)
+        coefficients = counts / counts.sum()
+
+        # Fold the clip scale into the averaging coefficients so the caller's
+        # matrix is never rewritten; nothing to fold when every client is in bounds.
+        clip = self.config.clipping_norm
+        # Accumulate in float64: float32 squared norms overflow to inf above ~1.8e19,
+        # which would zero the client's coefficient instead of clipping it.
+        norms_sq = np.einsum("kd,kd->k", matrix, matrix, dtype=np.float64)
+        # Memory-mapped rows are never scanned at load time; a non-finite norm is the cheap tell.
+        if not np.isfinite(norms_sq).all():
+            raise ValueError("Non-finite weights in client update")
+        over = norms_sq > clip * clip
+        if over.any():
+            coefficients[over] *= clip / np.sqrt(norms_sq[over])
+
+        # Matching dtypes keep this a single float32 BLAS gemv with no float64 copy of the matrix.
+        agg = coefficients.astype(matrix.dtype) @ matrix
 
         if self.config.noise_stddev > 0:
-            agg = [value + random.gauss(0.0, self.config.noise_stddev) for value in agg]
+            agg += self._rng.normal(0.0, self.config.noise_stddev, size=agg.shape).astype(agg.dtype, copy=False)
+
+        return agg.tolist()
+
+    def model_hash(self, aggregated_weights: Sequence[float] | np.ndarray) -> str:
+        # Canonical form: version tag, little-endian length, then IEEE float32 little-endian bytes.
+        values = np.ascontiguousarray(aggregated_weights, dtype="<f4")
+        buffer = memoryview(values).cast("B")
+
+        digest = hashlib.sha256(MODEL_HASH_VERSION)
+        digest.update(len(values).to_bytes(8, "little"))
+        for start in range(0, len(buffer), HASH_CHUNK_BYTES):
+            digest.update(buffer[start : start + HASH_CHUNK_BYTES])
+        return digest.hexdigest()
+
+    def _clip(self, vector: Sequence[float] | np.ndarray) -> List[float] | np.ndarray:
+        """Scale ``vector`` so its L2 norm is at most ``clipping_norm``.
+
+        ``vector`` is never modified (read-only memmap rows are fine). Arrays come back
+        as float32 arrays, a new one only when rescaling; plain sequences get a new list.
+        """
+        values = np.asarray(vector, dtype=np.float32)
+        clip = self.config.clipping_norm
+        sq = float(values @ values)
+        if sq > clip * clip:
+            values = values * np.float32(clip / math.sqrt(sq))
+
+        return values if isinstance(vector, np.ndarray) else values.tolist()
+
+
+def encode_weights(weights: Sequence[float] | np.ndarray, dtype: str = "float16") -> str:
+    """Encode a weight vector as base64 raw little-endian bytes for ``weights_b64``."""
+    if dtype not in WEIGHT_DTYPES:
+        raise ValueError(f"Unsupported weight dtype: {dtype}")
+
+    values = np.asarray(weights, dtype="<f4")
+    if dtype == "bfloat16":
+        # bfloat16 is the upper half of an IEEE float32 (truncating rounding).
+        raw = (values.view("<u4") >> 16).astype("<u2")
+    else:
+        raw = values.astype("<f2" if dtype == "float16" else "<f4")
+    return base64.b64encode(raw.tobytes()).decode("ascii")
+
+
+def _require_finite(values: np.ndarray, client_id: str) -> None:
+    # Values beyond float32 range become inf once stored; inf/NaN would poison FedAvg.
+    if not np.isfinite(values).all():
+        raise ValueError(f"Non-finite weights from client {client_id!r}")
+
+
+def _decode_weights(row: Dict) -> np.ndarray:
+    values = _decode_payload(row)
+    # Checked right after decoding: base64 payloads can carry raw inf/NaN bit patterns.
+    _require_finite(values, row["client_id"])
+    return values
+
+
+def _decode_payload(row: Dict) -> np.ndarray:
+    if "weights_b64" not in row:
+        return np.asarray(row["weights"], dtype=np.float32)
+
+    dtype = row.get("dtype", "float32")
+    if dtype not in WEIGHT_DTYPES:
+        raise ValueError(f"Unsupported weight dtype: {dtype}")
+
+    raw = base64.b64decode(row["weights_b64"])
+    if dtype == "bfloat16":
+        # NumPy has no bfloat16; widen to float32 by restoring the low mantissa bits.
+        return (np.frombuffer(raw, dtype="<u2").astype(np.uint32) << 16).view(np.float32)
+    return np.frombuffer(raw, dtype="<f2" if dtype == "float16" else "<f4")
+
+
+def _load_sidecar(manifest_path: str, manifest: Dict) -> ClientBatch:
+    """Map a raw (K, D) weight dump; pages are read only as aggregation touches them."""
+    # float32 only: a half-precision sidecar would be upcast whole in RAM by aggregate.
+    dtype = manifest.get("dtype", "float32")
+    if dtype != "float32":
+        raise ValueError(f"Unsupported sidecar dtype: {dtype}")
+
+    shape = tuple(int(n) for n in manifest["shape"])
+    clients = manifest.get("clients", [])
+    if len(shape) != 2 or shape[0] != len(clients):
+        raise ValueError("Sidecar shape must be [num_clients, dim] matching the clients list")
+    if shape[0] == 0:
+        raise ValueError("No client updates supplied")
+
+    bin_path = os.path.join(os.path.dirname(os.path.abspath(manifest_path)), manifest["weights_bin"])
+    expected_bytes = shape[0] * shape[1] * np.dtype("<f4").itemsize
+    if os.path.getsize(bin_path) != expected_bytes:
+        raise ValueError(f"Sidecar size does not match shape {list(shape)}: expected {expected_bytes} bytes")
+    weights = np.memmap(bin_path, dtype="<f4", mode="r", shape=shape)
+
+    return ClientBatch(
+        client_ids=[client["client_id"] for client in clients],
+        counts=np.fromiter((int(c["num_examples"]) for c in clients), dtype=np.int64, count=len(clients)),
+        weights=weights,
+    )
 
-        return agg
 
-    def model_hash(self, aggregated_weights: Sequence[float]) -> str:
-        payload = json.dumps([round(x, 8) for x in aggregated_weights], separators=(",", ":"))
-        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+def load_updates(path: str) -> ClientBatch:
+    with open(path, "rb") as f:
+        raw = f.read()
+    data = orjson.loads(raw) if orjson is not None else json.loads(raw)
 
-    def _clip(self, vector: Sequence[float]) -> List[float]:
-        norm = math.sqrt(sum(v * v for v in vector))
-        if norm <= self.config.clipping_norm or norm == 0:
-            return list(vector)
+    if isinstance(data, dict) and "weights_bin" in data:
+        return _load_sidecar(path, data)
 
-        scale = self.config.clipping_norm / norm
-        return [v * scale for v in vector]
+    if not data:
+        raise ValueError("No client updates supplied")
 
+    rows = [_decode_weights(row) for row in data]
+    dim = len(rows[0])
+    storage = np.float16 if all(r.dtype == np.float16 for r in rows) else np.float32
 
-def load_updates(path: str) -> List[ClientUpdate]:
-    with open(path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    weights = np.empty((len(data), dim), dtype=storage)
+    counts = np.empty(len(data), dtype=np.int64)
+    client_ids: List[str] = []
+    for row_index, (row, values) in enumerate(zip(data, rows)):
+        if len(values) != dim:
+            raise ValueError("All updates must have same dimension")
+        client_ids.append(row["client_id"])
+        counts[row_index] = int(row["num_examples"])
+        weights[row_index] = values
 
-    updates: List[ClientUpdate] = []
-    for row in data:
-        updates.append(
-            ClientUpdate(
-                client_id=row["client_id"],
-                num_examples=int(row["num_examples"]),
-                weights=[float(v) for v in row["weights"]],
-            )
-        )
-    return updates
+    return ClientBatch(client_ids=client_ids, counts=counts, weights=weights)
 
 
 def main() -> None:
     import argparse
 
     parser = argparse.ArgumentParser(description="Secure federated aggregator")
-    parser.add_argument("--updates", required=True, help="Path to JSON updates list")
+    parser.add_argument("--updates", required=True, help="Path to JSON updates list or sidecar manifest")
     parser.add_argument("--output", required=True, help="Path to output JSON")
     parser.add_argument("--clip", type=float, default=2.0)
     parser.add_argument("--noise", type=float, default=0.0)
 
     args = parser.parse_args()
 
-    updates = load_updates(args.updates)
+    batch = load_updates(args.updates)
     aggregator = SecureFederatedAggregator(
         AggregationConfig(clipping_norm=args.clip, noise_stddev=args.noise)
     )
 
-    merged = aggregator.aggregate(updates)
+    merged = aggregator.aggregate(batch)
     model_hash = aggregator.model_hash(merged)
 
     payload = {
         "weights": merged,
         "model_hash": model_hash,
-        "num_clients": len(updates),
+        "num_clients": len(batch.client_ids),
     }
 
     with open(args.output, "w", encoding="utf-8") as f:
@@ -17,7 +17,7 @@ import json
 import math
 import os
 from dataclasses import dataclass, asdict
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
 
 # Optional dependencies. Engine still works in reduced mode if they are unavailable.
 try:
@@ -45,15 +45,60 @@ try:
 except Exception:  # pragma: no cover
     decode_qr = None
 
+try:
+    import ahocorasick  # type: ignore
+except Exception:  # pragma: no cover
+    ahocorasick = None
 
-@dataclass
+MODEL_INPUT_SIZE = (224, 224)
+
+
+@dataclass(frozen=True)
 class ExpectedBatchProfile:
+    """Expected packaging facts for one batch. Frozen so the derived lookups never go stale."""
+
     product_name: str
     batch_number: str
     manufacturer_name: str
-    expected_tokens: List[str]
+    expected_tokens: Sequence[str]
     expected_qr_fields: Dict[str, str]
 
+    def __post_init__(self) -> None:
+        # Snapshot the caller's containers so later edits to them cannot desync the caches.
+        object.__setattr__(self, "expected_tokens", tuple(self.expected_tokens))
+        object.__setattr__(self, "expected_qr_fields", dict(self.expected_qr_fields or {}))
+
+        # Lowercased lookups precomputed once for the OCR/QR signal helpers. Plain
+        # attributes rather than fields, so asdict()/fields() keep the profile's shape.
+        tokens_lower = tuple(t.lower() for t in self.expected_tokens if t.strip())
+        object.__setattr__(self, "_tokens_lower", tokens_lower)
+        object.__setattr__(
+            self,
+            "_qr_pairs_lower",
+            tuple((key, str(value).lower()) for key, value in self.expected_qr_fields.items()),
+        )
+
+        automaton = None
+        if ahocorasick is not None and tokens_lower:
+            automaton = ahocorasick.Automaton()
+            for token in tokens_lower:
+                automaton.add_word(token, token)
+            automaton.make_automaton()
+        object.__setattr__(self, "_token_automaton", automaton)
+
+    @property
+    def tokens_lower(self) -> Tuple[str, ...]:
+        return self._tokens_lower
+
+    @property
+    def qr_pairs_lower(self) -> Tuple[Tuple[str, str], ...]:
+        return self._qr_pairs_lower
+
+    @property
+    def token_automaton(self) -> Any:
+        """Aho-Corasick automaton over ``tokens_lower``, or None without pyahocorasick."""
+        return self._token_automaton
+
 
 @dataclass
 class RiskAssessment:
@@ -72,15 +117,42 @@ class RiskEngineConfig:
     visual_weight: float = 0.1
     high_risk_threshold: float = 70.0
     review_threshold: float = 45.0
+    # Longest image side fed to Tesseract; larger frames are downscaled first.
+    ocr_max_dimension: int = 1600
+    # Frames larger than a grid of blur_sample_grid^2 tiles (blur_tile_size px each) are
+    # blur-checked on those native-resolution tiles so the threshold keeps its scale.
+    blur_sample_grid: int = 16
+    blur_tile_size: int = 32
+    blur_variance_threshold: float = 55.0
+    # QR detection runs on a frame whose longest side is at most this many pixels.
+    qr_max_dimension: int = 1024
 
 
 class CounterfeitRiskEngine:
     def __init__(self, model_path: Optional[str] = None, config: Optional[RiskEngineConfig] = None):
         self.config = config or RiskEngineConfig()
         self.session = None
+        self._qr_detector = cv2.QRCodeDetector() if cv2 is not None else None
 
         if model_path and ort is not None and os.path.exists(model_path):
-            self.session = ort.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+            self.session = self._create_session(model_path)
+            self._input_name = self.session.get_inputs()[0].name
+            self._output_name = self.session.get_outputs()[0].name
+            batch_dim = self.session.get_inputs()[0].shape[0]
+            self._dynamic_batch = not isinstance(batch_dim, int)
+
+    @staticmethod
+    def _create_session(model_path: str) -> Any:
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = os.cpu_count() or 1
+
+        providers: List[Any] = [("CPUExecutionProvider", {"enable_cpu_mem_arena": True})]
+        if "CUDAExecutionProvider" in ort.get_available_providers():
+            providers.insert(0, "CUDAExecutionProvider")
+
+        return ort.InferenceSession(model_path, options, providers=providers)
 
     def assess(
         self,
@@ -88,33 +160,90 @@ class CounterfeitRiskEngine:
         expected: ExpectedBatchProfile,
         packaging_notes: str = "",
     ) -> RiskAssessment:
-        signals: Dict[str, float] = {}
-        notes: List[str] = []
+        # Decode once and share the frame (and its grayscale view) across all signals.
+        image, gray = self._decode(image_path)
 
         # 1) Model signal (0 clean, 1 counterfeit probability)
-        model_signal = self._model_signal(image_path)
-        signals["model_counterfeit_probability"] = model_signal
+        model_signal = self._model_signals([image])[0]
+
+        image_signals, notes = self._image_signals(image, gray, bool(image_path), expected, packaging_notes)
+        return self._build_assessment(model_signal, image_signals, notes)
+
+    def assess_batch(
+        self,
+        image_paths: Sequence[Optional[str]],
+        expected: ExpectedBatchProfile,
+        packaging_notes: str = "",
+    ) -> List[RiskAssessment]:
+        """Assess several packaging photos, running the ONNX model once for the whole batch."""
+        model_inputs: List[Optional["np.ndarray"]] = []
+        pending: List[Tuple[Dict[str, float], List[str]]] = []
+        for image_path in image_paths:
+            image, gray = self._decode(image_path)
+            # Keep only the model-sized copy so full frames are released as we go.
+            if image is not None and self.session is not None:
+                model_inputs.append(cv2.resize(image, MODEL_INPUT_SIZE))
+            else:
+                model_inputs.append(None)
+            pending.append(self._image_signals(image, gray, bool(image_path), expected, packaging_notes))
+
+        model_signals = self._model_signals(model_inputs)
+        return [
+            self._build_assessment(model_signal, image_signals, notes)
+            for model_signal, (image_signals, notes) in zip(model_signals, pending)
+        ]
+
+    @staticmethod
+    def _decode(image_path: Optional[str]) -> Tuple[Optional["np.ndarray"], Optional["np.ndarray"]]:
+        if not image_path or cv2 is None:
+            return None, None
+
+        image = cv2.imread(image_path)
+        if image is None:
+            return None, None
+        return image, cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    def _image_signals(
+        self,
+        image: Optional["np.ndarray"],
+        gray: Optional["np.ndarray"],
+        has_image: bool,
+        expected: ExpectedBatchProfile,
+        packaging_notes: str,
+    ) -> Tuple[Dict[str, float], List[str]]:
+        signals: Dict[str, float] = {}
+        notes: List[str] = []
 
         # 2) OCR mismatch signal (0 good, 1 bad)
-        ocr_signal, ocr_notes = self._ocr_mismatch_signal(image_path, expected)
+        ocr_signal, ocr_notes = self._ocr_mismatch_signal(gray, expected, has_image)
         signals["ocr_mismatch"] = ocr_signal
         notes.extend(ocr_notes)
 
         # 3) QR mismatch signal (0 good, 1 bad)
-        qr_signal, qr_notes = self._qr_mismatch_signal(image_path, expected)
+        qr_signal, qr_notes = self._qr_mismatch_signal(image, expected, has_image)
         signals["qr_mismatch"] = qr_signal
         notes.extend(qr_notes)
 
         # 4) Visual quality anomaly signal (0 good, 1 suspicious)
-        visual_signal, visual_notes = self._visual_quality_signal(image_path, packaging_notes)
+        visual_signal, visual_notes = self._visual_quality_signal(gray, packaging_notes, has_image)
         signals["visual_anomaly"] = visual_signal
         notes.extend(visual_notes)
 
+        return signals, notes
+
+    def _build_assessment(
+        self,
+        model_signal: float,
+        image_signals: Dict[str, float],
+        notes: List[str],
+    ) -> RiskAssessment:
+        signals: Dict[str, float] = {"model_counterfeit_probability": model_signal, **image_signals}
+
         weighted = (
             model_signal * self.config.model_weight
-            + ocr_signal * self.config.ocr_weight
-            + qr_signal * self.config.qr_weight
-            + visual_signal * self.config.visual_weight
+            + signals["ocr_mismatch"] * self.config.ocr_weight
+            + signals["qr_mismatch"] * self.config.qr_weight
+            + signals["visual_anomaly"] * self.config.visual_weight
         )
 
         risk_score = round(weighted * 100.0, 2)
@@ -138,46 +267,57 @@ class CounterfeitRiskEngine:
             notes=notes,
         )
 
-    def _model_signal(self, image_path: Optional[str]) -> float:
-        if not image_path or not self.session or np is None or cv2 is None:
-            return 0.35
-
-        image = cv2.imread(image_path)
-        if image is None:
-            return 0.35
-
-        resized = cv2.resize(image, (224, 224))
-        inp = resized.astype("float32") / 255.0
-        inp = np.transpose(inp, (2, 0, 1))[None, :, :, :]
-
-        input_name = self.session.get_inputs()[0].name
-        output_name = self.session.get_outputs()[0].name
-
-        output = self.session.run([output_name], {input_name: inp})[0]
-        # Assume model outputs counterfeit probability in [0,1].
-        value = float(output.ravel()[0])
-        return min(1.0, max(0.0, value))
+    def _model_signals(self, images: Sequence[Optional["np.ndarray"]]) -> List[float]:
+        signals = [0.35] * len(images)
+        if not self.session or np is None or cv2 is None:
+            return signals
+
+        ready = [i for i, image in enumerate(images) if image is not None]
+        # Models exported with a fixed batch dimension are fed one image per run.
+        step = max(1, len(ready)) if self._dynamic_batch else 1
+        for start in range(0, len(ready), step):
+            chunk = ready[start : start + step]
+            # Resize, scale and HWC->CHW in one pass; yields an (N, 3, 224, 224) float32 tensor.
+            blob = cv2.dnn.blobFromImages(
+                [images[i] for i in chunk],
+                scalefactor=1.0 / 255.0,
+                size=MODEL_INPUT_SIZE,
+                mean=(0, 0, 0),
+                swapRB=False,
+                crop=False,
+            )
+
+            output = self.session.run([self._output_name], {self._input_name: blob})[0]
+            # Assume model outputs counterfeit probability in [0,1], one row per image.
+            for i, value in zip(chunk, output.reshape(len(chunk), -1)[:, 0]):
+                signals[i] = min(1.0, max(0.0, float(value)))
+        return signals
 
     def _ocr_mismatch_signal(
         self,
-        image_path: Optional[str],
+        gray: Optional["np.ndarray"],
         expected: ExpectedBatchProfile,
+        has_image: bool,
     ) -> Tuple[float, List[str]]:
-        if not image_path or pytesseract is None or cv2 is None:
+        if not has_image or pytesseract is None or cv2 is None:
             return 0.4, ["OCR unavailable; using conservative fallback"]
 
-        image = cv2.imread(image_path)
-        if image is None:
+        if gray is None:
             return 0.5, ["Image unreadable for OCR"]
 
-        text = pytesseract.image_to_string(image)
-        normalized = (text or "").lower()
-
-        required_tokens = [token.lower() for token in expected.expected_tokens if token.strip()]
+        required_tokens = expected.tokens_lower
         if not required_tokens:
             return 0.2, []
 
-        missing = [token for token in required_tokens if token not in normalized]
+        text = pytesseract.image_to_string(
+            self._prepare_ocr_image(gray),
+            lang="eng",
+            config="--oem 1 --psm 6",
+        )
+        normalized = (text or "").lower()
+
+        found = self._find_tokens(normalized, expected)
+        missing = [token for token in required_tokens if token not in found]
         mismatch_ratio = len(missing) / len(required_tokens)
 
         notes = []
@@ -186,64 +326,134 @@ class CounterfeitRiskEngine:
 
         return min(1.0, mismatch_ratio), notes
 
+    def _prepare_ocr_image(self, gray: "np.ndarray") -> "np.ndarray":
+        # Tesseract cost scales with pixel count; shrink to ~300 DPI and binarize.
+        height, width = gray.shape[:2]
+        scale = min(1.0, self.config.ocr_max_dimension / max(height, width))
+        if scale < 1.0:
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        return cv2.adaptiveThreshold(
+            gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 10
+        )
+
+    @staticmethod
+    def _find_tokens(text: str, expected: ExpectedBatchProfile) -> Set[str]:
+        automaton = expected.token_automaton
+        if automaton is None:
+            return {token for token in expected.tokens_lower if token in text}
+
+        # One linear scan finds every expected token.
+        return {token for _, token in automaton.iter(text)}
+
+    def _decode_qr_payload(self, image: "np.ndarray") -> Optional[str]:
+        # OpenCV's detector on a ~1 MP frame is the fast path; pyzbar on the full frame is
+        # the authoritative fallback. Without pyzbar a miss is inconclusive, so return None.
+        height, width = image.shape[:2]
+        scale = min(1.0, self.config.qr_max_dimension / max(height, width))
+        frame = image
+        if scale < 1.0:
+            frame = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        payload_text = self._detect_qr(frame)
+        if payload_text:
+            return payload_text
+
+        if decode_qr is not None:
+            qr_payloads = decode_qr(image)
+            return qr_payloads[0].data.decode("utf-8", errors="ignore") if qr_payloads else ""
+
+        return None
+
+    def _detect_qr(self, frame: "np.ndarray") -> str:
+        try:
+            payload_text, _, _ = self._qr_detector.detectAndDecode(frame)
+        except cv2.error:
+            return ""
+        return payload_text or ""
+
     def _qr_mismatch_signal(
         self,
-        image_path: Optional[str],
+        image: Optional["np.ndarray"],
         expected: ExpectedBatchProfile,
+        has_image: bool,
     ) -> Tuple[float, List[str]]:
-        if not image_path or decode_qr is None or cv2 is None:
+        if not has_image or cv2 is None:
             return 0.35, ["QR decoder unavailable; using conservative fallback"]
 
-        image = cv2.imread(image_path)
         if image is None:
             return 0.5, ["Image unreadable for QR"]
 
-        qr_payloads = decode_qr(image)
-        if not qr_payloads:
+        payload_text = self._decode_qr_payload(image)
+        if payload_text is None:
+            return 0.35, ["QR decoder unavailable; using conservative fallback"]
+        if not payload_text:
             return 0.8, ["No QR payload detected"]
 
-        payload_text = qr_payloads[0].data.decode("utf-8", errors="ignore")
         payload_lower = payload_text.lower()
 
-        expected_fields = expected.expected_qr_fields or {}
+        expected_fields = expected.qr_pairs_lower
         if not expected_fields:
             return 0.15, []
 
         mismatches = 0
         notes = []
-        for key, value in expected_fields.items():
-            if str(value).lower() not in payload_lower:
+        for key, value in expected_fields:
+            if value not in payload_lower:
                 mismatches += 1
                 notes.append(f"QR mismatch for field '{key}'")
 
         mismatch_ratio = mismatches / max(1, len(expected_fields))
         return min(1.0, mismatch_ratio), notes
 
-    def _visual_quality_signal(self, image_path: Optional[str], packaging_notes: str) -> Tuple[float, List[str]]:
+    def _visual_quality_signal(
+        self,
+        gray: Optional["np.ndarray"],
+        packaging_notes: str,
+        has_image: bool,
+    ) -> Tuple[float, List[str]]:
         note_terms = ["tamper", "blur", "seal", "smudge", "broken", "mismatch", "spelling"]
         notes_hits = sum(1 for t in note_terms if t in packaging_notes.lower())
         note_score = min(1.0, notes_hits / 4.0)
 
-        if not image_path or cv2 is None:
+        if not has_image or cv2 is None:
             return max(0.25, note_score), []
 
-        image = cv2.imread(image_path)
-        if image is None:
+        if gray is None:
             return max(0.4, note_score), ["Image unreadable for visual quality"]
 
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        blur_var = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+        blur_var = self._blur_variance(gray)
+        is_blurred = blur_var < self.config.blur_variance_threshold
 
         # Low variance can indicate blurred/low-quality prints or recaptured labels.
-        blur_risk = 0.7 if blur_var < 55 else 0.2
+        blur_risk = 0.7 if is_blurred else 0.2
         visual_signal = max(blur_risk, note_score)
 
         notes: List[str] = []
-        if blur_var < 55:
+        if is_blurred:
             notes.append("Packaging image appears unusually blurred")
 
         return min(1.0, visual_signal), notes
 
+    def _blur_variance(self, gray: "np.ndarray") -> float:
+        height, width = gray.shape[:2]
+        grid = self.config.blur_sample_grid
+        tile = self.config.blur_tile_size
+        # Downscaling would erase the fine detail being measured, so large frames are
+        # sampled as an evenly spaced grid of full-resolution tiles instead.
+        if height * width <= (grid * tile) ** 2 or min(height, width) < tile + 2:
+            return float(cv2.Laplacian(gray, cv2.CV_32F).var())
+
+        rows = np.linspace(1, height - tile - 1, grid).astype(int)
+        cols = np.linspace(1, width - tile - 1, grid).astype(int)
+        # Each tile keeps a 1 px margin so the 3x3 kernel never sees a synthetic border.
+        responses = [
+            cv2.Laplacian(gray[y - 1 : y + tile + 1, x - 1 : x + tile + 1], cv2.CV_32F)[1:-1, 1:-1]
+            for y in rows
+            for x in cols
+        ]
+        return float(np.stack(responses).var())
+
 
 def parse_expected_profile(path: str) -> ExpectedBatchProfile:
     with open(path, "r", encoding="utf-8") as f: